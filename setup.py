@@ -27,7 +27,11 @@ setup(name='smtp2zope',
       ],
       entry_points={
           'console_scripts': [
-              'smtp2zope = smtp2zope.script:main',
+              'smtp2zope = smtp2zope.client:main',
+              'smtp2zope-worker = smtp2zope.worker:main',
+              'smtp2zope-lockstat = smtp2zope.lockstat:main',
+              'smtp2zope-testbackend = smtp2zope.loadtest:backend_main',
+              'smtp2zope-loadtest = smtp2zope.loadtest:main',
               ],
           },
       )
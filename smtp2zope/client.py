@@ -0,0 +1,86 @@
+##
+# Thin client for a resident smtp2zope-worker.
+#
+# The MTA starts a new process for every email.  This client only
+# connects to the Unix socket of the worker, passes its arguments and
+# its standard input file descriptor along and exits with the exit code
+# the worker reports.  The worker reads the email straight from the MTA.
+#
+# Protocol: one line with the arguments separated by NUL characters,
+# then the standard input file descriptor (SCM_RIGHTS).  The worker
+# answers with the exit code on a single line.
+
+import errno
+import socket
+import sys
+
+from _multiprocessing import sendfd
+
+from smtp2zope import config
+
+# Errors that mean nobody is listening on the socket.
+NO_WORKER = (errno.ENOENT, errno.ECONNREFUSED)
+
+
+def encode_args(args):
+    return '\0'.join(args) + '\n'
+
+
+def decode_args(line):
+    line = line.rstrip('\n')
+    if not line:
+        return []
+    return line.split('\0')
+
+
+def connect(path):
+    """Return a socket connected to the worker, or None."""
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(path)
+    except socket.error, e:
+        sock.close()
+        if e.errno in NO_WORKER:
+            return None
+        raise
+    return sock
+
+
+def handover(sock, args, mailfile):
+    """Pass the arguments and email to the worker and return its verdict."""
+    sock.sendall(encode_args(args))
+    sendfd(sock.fileno(), mailfile.fileno())
+    sock.shutdown(socket.SHUT_WR)
+    answer = sock.makefile('rb').readline()
+    return int(answer)
+
+
+def main():
+    sock = None
+    if config.WORKER_SOCKET:
+        try:
+            sock = connect(config.WORKER_SOCKET)
+        except socket.error, e:
+            if e.errno != errno.EACCES:
+                raise
+            # Most likely the permissions of the socket are wrong.
+            from smtp2zope import script
+            script.log_error('Cannot connect to worker at %s (%s), '
+                             'delivering without it.' % (
+                                 config.WORKER_SOCKET, e))
+    if sock is None:
+        # No worker, so do all the work ourselves.
+        from smtp2zope import script
+        script.main()
+        return
+    try:
+        status = handover(sock, sys.argv[1:], sys.stdin)
+    except (EnvironmentError, ValueError), e:
+        # The worker may have read part of the email already, so we
+        # cannot fall back to delivering ourselves.  Let the MTA try
+        # again later.
+        from smtp2zope import script
+        script.log_error('Lost connection to worker at %s (%s).' % (
+            config.WORKER_SOCKET, e))
+        sys.exit(script.EXIT_TEMPFAIL)
+    sys.exit(status)
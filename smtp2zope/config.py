@@ -35,14 +35,85 @@ USE_LOCKS = 1
 # if not, set it on your own (e.g. '/tmp/smtp2zope.lock').
 LOCKFILE_LOCATION = os.path.join(tempfile.gettempdir(), 'smtp2zope.lock')
 
+##
+# If you wish to see how long mails wait for the lock and hold it, set
+# this to a file (e.g. '/var/log/smtp2zope-lockstats.log').  Every lock
+# event is appended to it.  Use the smtp2zope-lockstat script to
+# summarise it.  The file is not rotated for you.
+LOCKSTATS_LOCATION = ''
+
 ##
 # The amount of time in seconds to wait to be serialised.
 LOCK_TIMEOUT = 30
 
 ##
-# Number of seconds the process expects to hold the lock.
-DEFAULT_LOCK_LIFETIME = 30
+# Number of seconds the process expects to hold the lock.  When another
+# process finds the lock older than this, it assumes the holder has died
+# and takes over the lock.  The holder refreshes the lock every
+# LOCK_HEARTBEAT_INTERVAL seconds, so this can be short.
+DEFAULT_LOCK_LIFETIME = 2
+
+##
+# Number of seconds between refreshes of the lock while it is held.  0
+# disables this; set DEFAULT_LOCK_LIFETIME to 30 or more in that case,
+# so big uploads do not lose the lock.
+LOCK_HEARTBEAT_INTERVAL = 0.5
+
+##
+# Maximum number of seconds the lock is refreshed.  After this, the
+# holder is assumed to hang and other processes may break the lock.
+LOCK_MAX_HOLD = 300
+
+##
+# Number of seconds to wait for the server while uploading or waiting for
+# an answer, before giving up and letting the MTA try again later.
+UPLOAD_TIMEOUT = 120
+
+##
+# Number of seconds to remember that a url accepted an email or did not
+# exist.  Emails for a url that did not exist are bounced right away,
+# without reading the email or waiting for the lock.  0 disables this.
+ENDPOINT_CACHE_TTL = 60
+
+##
+# Directory for remembering the status of urls.  It is only used when it
+# is owned by the user running smtp2zope and not writable by others.
+ENDPOINT_CACHE_LOCATION = os.path.join(tempfile.gettempdir(),
+                                       'smtp2zope.endpoints')
+
+##
+# If you wish to let the server refuse an email before it is uploaded,
+# set USE_EXPECT_CONTINUE = 1.  The headers are then sent with
+# 'Expect: 100-continue' and the email only follows when the server
+# agrees, or when it does not answer within EXPECT_CONTINUE_TIMEOUT
+# seconds.  Urls that recently accepted an email are not asked.  This
+# only works for http urls, not for https.
+USE_EXPECT_CONTINUE = 0
+EXPECT_CONTINUE_TIMEOUT = 1
 
 ##
 # REQUEST-parameter for submitted mail via URL
 MAIL_PARAMETER_NAME = "Mail"
+
+##
+# Unix socket of a resident smtp2zope-worker.  When set, the smtp2zope
+# script hands the email over to the worker instead of loading the
+# complete delivery code for every email.  When the worker cannot be
+# reached, the email is delivered by the script itself.
+# Example: WORKER_SOCKET = os.path.join(tempfile.gettempdir(),
+#                                       'smtp2zope.sock')
+WORKER_SOCKET = ''
+
+##
+# If you wish to parse the email here instead of in Zope, set
+# STRUCTURED_PAYLOAD = 1.  The email is then posted as multipart/form-data
+# with the decoded headers, bodies and attachments as separate fields,
+# normally next to the raw email in MAIL_PARAMETER_NAME.  See payload.py.
+STRUCTURED_PAYLOAD = 0
+
+##
+# With STRUCTURED_PAYLOAD, the raw email is posted next to the parsed
+# fields, so existing handlers keep working.  This roughly doubles the
+# size of the upload for emails with attachments.  Set
+# STRUCTURED_RAW_MAIL = 0 when your handler only uses the parsed fields.
+STRUCTURED_RAW_MAIL = 1
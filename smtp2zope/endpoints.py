@@ -0,0 +1,86 @@
+##
+# Cache of urls that recently accepted an email or did not exist.
+#
+# Every url gets a small file in ENDPOINT_CACHE_LOCATION, named after the
+# md5 of the url, so passwords in urls do not end up on disk.  The file
+# contains the http status code; its modification time tells when the
+# status was seen.
+
+import errno
+import os
+import stat
+import tempfile
+import time
+
+from hashlib import md5
+
+from smtp2zope import config
+
+VALID = 200
+NOT_FOUND = 404
+
+
+def cache_path(url):
+    return os.path.join(config.ENDPOINT_CACHE_LOCATION,
+                        md5(url).hexdigest())
+
+
+def trusted_directory():
+    """Return true if the cache directory is ours to trust.
+
+    The cache lives in the world writable temporary directory by default.
+    Anybody who could plant files in it could let us bounce emails, so
+    only use a real directory owned by us and not writable by others.
+    """
+    try:
+        info = os.lstat(config.ENDPOINT_CACHE_LOCATION)
+    except OSError:
+        return False
+    return (stat.S_ISDIR(info.st_mode) and info.st_uid == os.getuid()
+            and not info.st_mode & stat.S_IWOTH)
+
+
+def lookup(url):
+    """Return the status recently seen for this url, or None."""
+    if not config.ENDPOINT_CACHE_TTL or not trusted_directory():
+        return None
+    path = cache_path(url)
+    try:
+        if os.stat(path).st_mtime + config.ENDPOINT_CACHE_TTL < time.time():
+            return None
+        fp = open(path)
+        try:
+            return int(fp.read())
+        finally:
+            fp.close()
+    except (EnvironmentError, ValueError):
+        return None
+
+
+def remember(url, status):
+    """Remember the status for this url."""
+    if not config.ENDPOINT_CACHE_TTL:
+        return
+    directory = config.ENDPOINT_CACHE_LOCATION
+    try:
+        try:
+            # Make sure it's group writable
+            os.mkdir(directory)
+            os.chmod(directory, 0775)
+        except OSError, e:
+            if e.errno != errno.EEXIST:
+                raise
+        if not trusted_directory():
+            return
+        # Write to a temporary file and rename it, so readers never see a
+        # half written file.  mkstemp makes it readable for us only.
+        fd, tmpname = tempfile.mkstemp(dir=directory)
+        try:
+            os.fchmod(fd, 0664)
+            os.write(fd, str(status))
+        finally:
+            os.close(fd)
+        os.rename(tmpname, cache_path(url))
+    except EnvironmentError:
+        # Then the next email for this url simply asks the server again.
+        pass
@@ -0,0 +1,328 @@
+##
+# Fault-injecting stand-in backend and load driver.
+#
+# Usage: smtp2zope-testbackend [options] PROFILE
+#        smtp2zope-loadtest [options] [PROFILE ...]
+#
+# The backend accepts posted emails like a Zope mail handler would, but
+# misbehaves according to a fault profile.  A profile is the name of one
+# of the PROFILES below or a comma separated list of:
+#
+# latency=DIST:ARG[:ARG]  = wait before answering; DIST is a function of
+#                           the random module, e.g. uniform:0.5:2 or
+#                           expovariate:5 (mean of 0.2 seconds)
+# error=PROB:CODE         = answer with this http status code
+# reset=PROB              = reset the connection instead of answering
+# stall=PROB:SECONDS      = send the status line, then stall
+#
+# PROB is a probability between 0 and 1.  Faults are tried in order and
+# at most one fault happens per request.
+#
+# The load driver starts the backend on localhost for each profile,
+# delivers a number of emails with concurrent smtp2zope processes and
+# reports the exit codes, the lock timeout rate and latency percentiles.
+# Everything runs offline, with its own lock file and url cache.
+
+import BaseHTTPServer
+import errno
+import optparse
+import os
+import random
+import shutil
+import socket
+import SocketServer
+import struct
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+from smtp2zope import config
+from smtp2zope.lockstat import format_percentiles
+from smtp2zope.lockstat import read_stats
+
+PROFILES = {
+    'ok': '',
+    'slow': 'latency=uniform:0.5:2',
+    'jittery': 'latency=expovariate:5',
+    'flapping': 'error=0.5:503',
+    'notfound': 'error=1:404',
+    'error': 'error=1:500',
+    'unavailable': 'error=1:503',
+    'reset': 'reset=0.5',
+    'redirect': 'error=0.5:302,error=1:301',
+    'stall': 'stall=0.2:5',
+    }
+
+# Started by the load driver for every email.  Takes the lock file,
+# statistics file, lock timeout, url cache directory and url cache ttl
+# as first arguments, followed by the normal smtp2zope arguments.
+BOOTSTRAP = """
+import sys
+from smtp2zope import config
+from smtp2zope import script
+config.LOCKFILE_LOCATION, config.LOCKSTATS_LOCATION = sys.argv[1:3]
+config.LOCK_TIMEOUT = float(sys.argv[3])
+config.ENDPOINT_CACHE_LOCATION = sys.argv[4]
+config.ENDPOINT_CACHE_TTL = float(sys.argv[5])
+del sys.argv[1:6]
+# Keep the mail log clean.
+script.log_critical = script.log_error = lambda msg: None
+script.log_warning = script.log_info = lambda msg: None
+script.main()
+"""
+
+# Redirects point here.  Requests for it always succeed, so a redirect
+# that is followed shows up as a successful delivery.
+REDIRECT_PATH = '/elsewhere'
+
+TESTMAIL = """\
+From: loadtest@example.org
+To: list@example.org
+Subject: smtp2zope load test
+
+"""
+
+
+class Profile(object):
+    """Fault profile for the backend."""
+
+    def __init__(self, spec):
+        self.spec = PROFILES.get(spec, spec)
+        self.latency = None
+        self.faults = []
+        for item in self.spec.split(','):
+            if not item.strip():
+                continue
+            key, value = item.strip().split('=', 1)
+            args = value.split(':')
+            if key == 'latency':
+                func = getattr(random, args[0])
+                self.latency = (func, [float(arg) for arg in args[1:]])
+            elif key == 'error':
+                self.faults.append((float(args[0]), 'error', int(args[1])))
+            elif key == 'reset':
+                self.faults.append((float(args[0]), 'reset', None))
+            elif key == 'stall':
+                self.faults.append((float(args[0]), 'stall',
+                                    float(args[1])))
+            else:
+                raise ValueError('Unknown fault %r.' % key)
+
+    def delay(self):
+        if self.latency is None:
+            return 0
+        func, args = self.latency
+        return max(func(*args), 0)
+
+    def fault(self):
+        """Return the action and argument for a request, or None."""
+        for probability, action, arg in self.faults:
+            if random.random() < probability:
+                return action, arg
+        return None
+
+
+def parse_profile(parser, spec):
+    try:
+        return Profile(spec)
+    except (AttributeError, IndexError, ValueError), e:
+        parser.error('Invalid profile %r (%s).' % (spec, e))
+
+
+class FaultyHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+
+    def do_POST(self):
+        if self.path == REDIRECT_PATH:
+            self.answer(200)
+            return
+        profile = self.server.profile
+        fault = profile.fault()
+        if self.headers.get('Expect', '').lower() == '100-continue':
+            if fault is not None and fault[0] == 'error':
+                # Refuse before the upload.
+                time.sleep(profile.delay())
+                self.answer(fault[1])
+                self.close_connection = 1
+                return
+            self.wfile.write('%s 100 Continue\r\n\r\n' %
+                             self.protocol_version)
+            self.wfile.flush()
+        # Read the complete upload, as a real backend would.
+        length = int(self.headers.get('Content-Length', 0))
+        while length > 0:
+            length -= len(self.rfile.read(min(length, 65536)))
+        time.sleep(profile.delay())
+        if fault is None:
+            self.answer(200)
+            return
+        action, arg = fault
+        if action == 'error':
+            self.answer(arg)
+        elif action == 'reset':
+            # Closing with a zero linger time sends a reset.
+            self.wfile.close()
+            self.connection.setsockopt(socket.SOL_SOCKET, socket.SO_LINGER,
+                                       struct.pack('ii', 1, 0))
+            self.connection.close()
+        elif action == 'stall':
+            self.wfile.write('%s 200 OK\r\n' % self.protocol_version)
+            self.wfile.flush()
+            time.sleep(arg)
+            self.end_headers()
+            self.wfile.write('OK')
+
+    # urllib2 follows a redirect of a post with a get.
+    do_GET = do_POST
+
+    def answer(self, code):
+        self.send_response(code)
+        if 300 <= code < 400:
+            self.send_header('Location', 'http://%s:%d%s' % (
+                self.server.server_address + (REDIRECT_PATH,)))
+        self.send_header('Content-Type', 'text/plain')
+        self.end_headers()
+        self.wfile.write(str(code))
+
+    def log_message(self, format, *args):
+        pass
+
+
+class FaultyServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, address, profile):
+        BaseHTTPServer.HTTPServer.__init__(self, address, FaultyHandler)
+        self.profile = profile
+
+
+def start_backend(profile, host='127.0.0.1', port=0):
+    """Start a backend in a thread and return the server."""
+    server = FaultyServer((host, port), profile)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.setDaemon(True)
+    thread.start()
+    return server
+
+
+def run_scenario(profile, messages, concurrency, mail, lock_timeout,
+                 cache_ttl=0):
+    """Deliver the mail a number of times and return the results.
+
+    Returns a mapping of exit code to count, the sorted latencies, the
+    lock events and the elapsed time.
+    """
+    tmpdir = tempfile.mkdtemp(prefix='smtp2zope-loadtest-')
+    server = start_backend(profile)
+    url = 'http://%s:%d/handler' % server.server_address
+    lockfile = os.path.join(tmpdir, 'smtp2zope.lock')
+    statsfile = os.path.join(tmpdir, 'lockstats.log')
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(sys.path))
+    cachedir = os.path.join(tmpdir, 'endpoints')
+    command = [sys.executable, '-c', BOOTSTRAP, lockfile, statsfile,
+               str(lock_timeout), cachedir, str(cache_ttl), url]
+    codes = {}
+    latencies = []
+    running = []
+    pending = messages
+    start = time.time()
+    try:
+        while pending or running:
+            while pending and len(running) < concurrency:
+                proc = subprocess.Popen(command, stdin=subprocess.PIPE,
+                                        env=env)
+                started = time.time()
+                try:
+                    proc.stdin.write(mail)
+                except IOError, e:
+                    # smtp2zope may exit without reading the email, for
+                    # example for a url that does not exist.  Its exit
+                    # code is counted below.
+                    if e.errno != errno.EPIPE:
+                        raise
+                proc.stdin.close()
+                running.append((proc, started))
+                pending -= 1
+            for proc, started in running[:]:
+                code = proc.poll()
+                if code is None:
+                    continue
+                running.remove((proc, started))
+                latencies.append(time.time() - started)
+                codes[code] = codes.get(code, 0) + 1
+            time.sleep(0.01)
+        elapsed = time.time() - start
+        events = read_stats(statsfile)
+    finally:
+        server.shutdown()
+        server.server_close()
+        shutil.rmtree(tmpdir)
+    latencies.sort()
+    return codes, latencies, events, elapsed
+
+
+def report(name, messages, codes, latencies, events, elapsed):
+    print 'Profile %s: %d emails in %.1f seconds (%.1f per second)' % (
+        name, messages, elapsed, messages / elapsed)
+    print '  Exit codes: %s' % ', '.join(
+        '%d: %d' % (code, count) for code, count in sorted(codes.items()))
+    timeouts = len(events.get('timeout', []))
+    print '  Lock timeouts: %d (%.1f%%)' % (
+        timeouts, 100.0 * timeouts / messages)
+    print '  Latency: %s' % format_percentiles(latencies)
+    for label, event in (('Lock wait', 'acquire'), ('Lock hold', 'hold')):
+        if events.get(event):
+            print '  %s: %s' % (label, format_percentiles(events[event]))
+
+
+def backend_main():
+    parser = optparse.OptionParser(usage='%prog [options] PROFILE')
+    parser.add_option('--host', default='127.0.0.1',
+                      help='address to listen on [default: %default]')
+    parser.add_option('-p', '--port', type='int', default=8080,
+                      help='port to listen on [default: %default]')
+    options, args = parser.parse_args()
+    if len(args) != 1:
+        parser.error('Give one profile: %s or a fault list.' %
+                     ', '.join(sorted(PROFILES)))
+    profile = parse_profile(parser, args[0])
+    server = FaultyServer((options.host, options.port), profile)
+    print 'Serving profile %r on http://%s:%d/' % (
+        (args[0],) + server.server_address)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+def main():
+    parser = optparse.OptionParser(usage='%prog [options] [PROFILE ...]')
+    parser.add_option('-n', '--messages', type='int', default=50,
+                      help='emails per profile [default: %default]')
+    parser.add_option('-c', '--concurrency', type='int', default=10,
+                      help='concurrent smtp2zope processes '
+                      '[default: %default]')
+    parser.add_option('-s', '--size', type='int', default=10000,
+                      help='size of the email body in bytes '
+                      '[default: %default]')
+    parser.add_option('-t', '--lock-timeout', type='float',
+                      default=config.LOCK_TIMEOUT,
+                      help='seconds to wait for the lock [default: %default]')
+    parser.add_option('--cache-ttl', type='float', default=0,
+                      help='seconds to remember the status of the url; '
+                      'with 0 every email reaches the backend '
+                      '[default: %default]')
+    options, args = parser.parse_args()
+    if options.messages < 1 or options.concurrency < 1:
+        parser.error('Messages and concurrency must be at least 1.')
+    mail = TESTMAIL + 'x' * options.size + '\n'
+    profiles = [(spec, parse_profile(parser, spec))
+                for spec in args or sorted(PROFILES)]
+    for spec, profile in profiles:
+        codes, latencies, events, elapsed = run_scenario(
+            profile, options.messages, options.concurrency, mail,
+            options.lock_timeout, options.cache_ttl)
+        report(spec, options.messages, codes, latencies, events, elapsed)
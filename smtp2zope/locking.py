@@ -4,11 +4,12 @@
 # This code has been taken from the GNU MailMan mailing list system,
 # with our thanks. Code was modified by Maik Jablonski.
 
-from stat import ST_NLINK, ST_MTIME
+from stat import ST_NLINK
 import errno
 import os
 import random
 import socket
+import threading
 import time
 
 from smtp2zope.config import DEFAULT_LOCK_LIFETIME
@@ -32,22 +33,56 @@ class TimeOutError(LockError):
     """The timeout interval elapsed before the lock succeeded."""
 
 
+def split_tmpfname(lockfile, filename):
+    """Return hostname, pid and counter encoded in a temporary lock file.
+
+    Returns None when filename is not a temporary file of lockfile.
+    """
+    prefix = lockfile + '.'
+    if not filename or not filename.startswith(prefix):
+        return None
+    # The hostname may contain dots itself.
+    parts = filename[len(prefix):].rsplit('.', 2)
+    if len(parts) != 3:
+        return None
+    try:
+        return parts[0], int(parts[1]), int(parts[2])
+    except ValueError:
+        return None
+
+
+def process_alive(pid):
+    """Return true if a process with this pid exists on this host."""
+    try:
+        os.kill(pid, 0)
+    except OSError, e:
+        if e.errno == errno.ESRCH:
+            return False
+        # EPERM: it exists, but belongs to someone else.
+    return True
+
+
 class LockFile:
     """A portable way to lock resources by way of the file system. """
 
     COUNTER = 0
 
-    def __init__(self, lockfile, lifetime=DEFAULT_LOCK_LIFETIME):
+    def __init__(self, lockfile, lifetime=DEFAULT_LOCK_LIFETIME,
+                 statsfile=None):
         """Create the resource lock using lockfile as the global lock file.
 
         Each process laying claim to this resource lock will create their own
         temporary lock files based on the path specified by lockfile.
         Optional lifetime is the number of seconds the process expects to hold
         the lock.  (see the module docstring for details).
+        With optional statsfile, lock events are appended to that file.
 
         """
         self.__lockfile = lockfile
         self.__lifetime = lifetime
+        self.__statsfile = statsfile
+        self.__acquired = None
+        self.__heartbeat = None
         # This works because we know we're single threaded
         self.__counter = LockFile.COUNTER
         LockFile.COUNTER += 1
@@ -82,6 +117,24 @@ class LockFile:
         if not self.locked() and not unconditionally:
             raise NotLockedError('%s: %s' % (repr(self), self.__read()))
 
+    def start_heartbeat(self, interval, maxhold=None):
+        """Refresh the lock every interval seconds until it is unlocked.
+
+        This runs in a background thread, so the lock lifetime can be much
+        shorter than the time the lock is held.  The heartbeat stops by
+        itself when the lock turns out to be stolen, or after optional
+        maxhold seconds, so a hanging holder cannot keep the lock forever.
+        """
+        self.__stop_heartbeat()
+        stop = threading.Event()
+        if maxhold is not None:
+            maxhold = time.time() + maxhold
+        thread = threading.Thread(target=self.__beat,
+                                  args=(stop, interval, maxhold))
+        thread.setDaemon(True)
+        self.__heartbeat = (thread, stop)
+        thread.start()
+
     def lock(self, timeout=0):
         """Acquire the lock.
 
@@ -90,8 +143,9 @@ class LockFile:
         number of seconds (or possibly more) expires without lock acquisition.
         Raises AlreadyLockedError if the lock is already set.
         """
+        start = time.time()
         if timeout:
-            timeout_time = time.time() + timeout
+            timeout_time = start + timeout
         # Make sure my temp lockfile exists, and that its contents are
         # up-to-date (e.g. the temp file name, and the lock lifetime).
         self.__write()
@@ -109,6 +163,8 @@ class LockFile:
                 # had it before, so we're done.  Just touch it again for the
                 # fun of it.
                 self.__touch()
+                self.__acquired = time.time()
+                self.__record('acquire', self.__acquired - start)
                 break
             except OSError, e:
                 # The link failed for some reason, possibly because someone
@@ -140,12 +196,16 @@ class LockFile:
             # it.  Have we timed out in our quest for the lock?
             if timeout and timeout_time < time.time():
                 os.unlink(self.__tmpfname)
+                self.__record('timeout', time.time() - start)
                 raise TimeOutError
             # Okay, we haven't timed out, but we didn't get the lock.  Let's
-            # find if the lock lifetime has expired.
-            if time.time() > self.__releasetime():
+            # find if the lock lifetime has expired, or if the owner of the
+            # lock is a process on this host that no longer exists.
+            winner = self.__read()
+            if (time.time() > self.__releasetime()
+                    or self.__owner_died(winner)):
                 # Yes, so break the lock.
-                self.__break()
+                self.__break(winner)
             # Okay, someone else has the lock, our claim hasn't timed out yet,
             # and the expected lock lifetime hasn't expired yet.  So let's
             # wait a while for the owner of the lock to give it up.
@@ -158,6 +218,7 @@ class LockFile:
         calls, or because the lock was stolen out from under us), raise a
         NotLockedError, unless optional `unconditionally' is true.
         """
+        self.__stop_heartbeat()
         islocked = self.locked()
         if not islocked and not unconditionally:
             raise NotLockedError
@@ -168,6 +229,9 @@ class LockFile:
             except OSError, e:
                 if e.errno != errno.ENOENT:
                     raise
+            if self.__acquired is not None:
+                self.__record('hold', time.time() - self.__acquired)
+        self.__acquired = None
         # Remove our tempfile
         try:
             os.unlink(self.__tmpfname)
@@ -206,6 +270,61 @@ class LockFile:
     # Private interface
     #
 
+    def __beat(self, stop, interval, maxhold):
+        while True:
+            stop.wait(interval)
+            if stop.isSet():
+                return
+            if maxhold is not None and time.time() > maxhold:
+                # Let the lock expire, so others can break it.
+                return
+            try:
+                self.refresh()
+            except NotLockedError:
+                return
+
+    def __stop_heartbeat(self):
+        if self.__heartbeat is None:
+            return
+        thread, stop = self.__heartbeat
+        self.__heartbeat = None
+        stop.set()
+        if thread is not threading.currentThread():
+            thread.join()
+
+    def __owner_died(self, winner):
+        info = split_tmpfname(self.__lockfile, winner)
+        if info is None:
+            return False
+        hostname, pid, counter = info
+        # We can only look at processes on our own host.
+        if hostname != socket.gethostname() or pid == os.getpid():
+            return False
+        return not process_alive(pid)
+
+    def __record(self, event, seconds):
+        # Append one line per event.  Appends of a single short write do
+        # not interleave, so no locking is needed here.
+        if not self.__statsfile:
+            return
+        hostname, pid, counter = split_tmpfname(self.__lockfile,
+                                                self.__tmpfname)
+        line = '%.3f %s %d %s %.3f\n' % (time.time(), hostname, pid, event,
+                                         seconds)
+        oldmask = os.umask(002)
+        try:
+            fd = os.open(self.__statsfile,
+                         os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0666)
+            try:
+                os.write(fd, line)
+            finally:
+                os.close(fd)
+        except EnvironmentError:
+            # Statistics are never worth failing a delivery for.
+            pass
+        finally:
+            os.umask(oldmask)
+
     def __write(self):
         # Make sure it's group writable
         oldmask = os.umask(002)
@@ -237,8 +356,9 @@ class LockFile:
                 raise
 
     def __releasetime(self):
+        # Not ST_MTIME, which is whole seconds: the lifetime can be short.
         try:
-            return os.stat(self.__lockfile)[ST_MTIME]
+            return os.stat(self.__lockfile).st_mtime
         except OSError, e:
             if e.errno != errno.ENOENT:
                 raise
@@ -252,14 +372,23 @@ class LockFile:
                 raise
             return -1
 
-    def __break(self):
+    def __break(self, winner):
+        # Another waiter may have broken the lock of this winner already
+        # and taken it.  Leave that new owner alone.
+        if winner is None or self.__read() != winner:
+            return
+        # How long the lock has outlived its lifetime.  This is 0 when
+        # the owner died before that.
+        releasetime = self.__releasetime()
+        overdue = 0
+        if releasetime > 0:
+            overdue = max(time.time() - releasetime, 0)
         try:
             self.__touch(self.__lockfile)
         except OSError, e:
             if e.errno != errno.EPERM:
                 raise
-        # Get the name of the old winner's temp file.
-        winner = self.__read()
+        self.__record('break', overdue)
         # Remove the global lockfile, which actually breaks the lock.
         try:
             os.unlink(self.__lockfile)
@@ -276,5 +405,6 @@ class LockFile:
                 raise
 
     def __sleep(self):
-        interval = random.random() * 2.0 + 0.01
+        # With a short lifetime, look more often whether it has expired.
+        interval = random.random() * min(self.__lifetime / 4.0, 2.0) + 0.01
         time.sleep(interval)
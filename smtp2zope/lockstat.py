@@ -0,0 +1,192 @@
+##
+# Show who holds the smtp2zope lock and how it has been used.
+#
+# Usage: smtp2zope-lockstat [options]
+#
+# Shows the current holder of the lock, the processes waiting for it and
+# temporary lock files left behind by processes that are gone.  When
+# LOCKSTATS_LOCATION is set, wait and hold time percentiles and the
+# number of timeouts and broken stale locks are shown as well.
+
+import glob
+import math
+import optparse
+import os
+import socket
+import time
+
+from smtp2zope import config
+from smtp2zope.locking import process_alive
+from smtp2zope.locking import split_tmpfname
+
+PERCENTILES = (50, 90, 99, 100)
+
+
+def percentile(values, percent):
+    """Return the percentile of the sorted values (nearest rank)."""
+    if not values:
+        return None
+    index = int(math.ceil(percent / 100.0 * len(values))) - 1
+    return values[max(index, 0)]
+
+
+def read_holder(lockfile):
+    """Return the temporary file name of the lock holder, or None."""
+    try:
+        fp = open(lockfile)
+        try:
+            return fp.read()
+        finally:
+            fp.close()
+    except IOError:
+        return None
+
+
+def process_state(lockfile, filename):
+    """Describe the process that created a temporary lock file.
+
+    Returns a tuple of description and a flag that is true when the
+    process is known to be gone.
+    """
+    info = split_tmpfname(lockfile, filename)
+    if info is None:
+        return 'unknown', False
+    hostname, pid, counter = info
+    if hostname != socket.gethostname():
+        return 'pid %d on %s' % (pid, hostname), False
+    if process_alive(pid):
+        return 'pid %d, running' % pid, False
+    return 'pid %d, gone' % pid, True
+
+
+def temp_files(lockfile):
+    return [name for name in glob.glob(lockfile + '.*')
+            if split_tmpfname(lockfile, name) is not None]
+
+
+def read_stats(statsfile):
+    """Return a mapping of event name to a sorted list of durations."""
+    events = {}
+    try:
+        fp = open(statsfile)
+    except IOError:
+        return events
+    try:
+        for line in fp:
+            parts = line.split()
+            if len(parts) != 5:
+                continue
+            try:
+                seconds = float(parts[4])
+            except ValueError:
+                continue
+            events.setdefault(parts[3], []).append(seconds)
+    finally:
+        fp.close()
+    for values in events.values():
+        values.sort()
+    return events
+
+
+def acquired_at(statsfile, hostname, pid):
+    """Return when this process last acquired the lock, or None."""
+    acquired = None
+    try:
+        fp = open(statsfile)
+    except IOError:
+        return acquired
+    try:
+        for line in fp:
+            parts = line.split()
+            if (len(parts) == 5 and parts[3] == 'acquire'
+                    and parts[1] == hostname and parts[2] == str(pid)):
+                try:
+                    acquired = float(parts[0])
+                except ValueError:
+                    pass
+    finally:
+        fp.close()
+    return acquired
+
+
+def format_percentiles(values):
+    return '  '.join('p%d=%.3fs' % (p, percentile(values, p))
+                     for p in PERCENTILES)
+
+
+def main():
+    parser = optparse.OptionParser(usage='%prog [options]')
+    parser.add_option('-l', '--lockfile', default=config.LOCKFILE_LOCATION,
+                      help='lock file [default: %default]')
+    parser.add_option('-s', '--stats', default=config.LOCKSTATS_LOCATION,
+                      help='lock statistics file [default: %default]')
+    parser.add_option('-c', '--clean', action='store_true', default=False,
+                      help='remove temporary lock files of processes '
+                      'that are gone')
+    options, args = parser.parse_args()
+    if args:
+        parser.error('Unexpected arguments.')
+    lockfile = options.lockfile
+
+    print 'Lock file: %s' % lockfile
+    holder = read_holder(lockfile)
+    if holder:
+        state = process_state(lockfile, holder)[0]
+        print 'Holder: %s (%s)' % (holder, state)
+        info = split_tmpfname(lockfile, holder)
+        acquired = None
+        if info is not None and options.stats:
+            acquired = acquired_at(options.stats, info[0], info[1])
+        if acquired is not None:
+            print 'Held for %.1f seconds.' % (time.time() - acquired)
+        try:
+            remaining = os.stat(lockfile).st_mtime - time.time()
+        except OSError:
+            remaining = None
+        # The holder keeps refreshing the lifetime, so it is only worth
+        # mentioning when it has ended.
+        if remaining is not None and remaining < 0:
+            print 'Lifetime ended %.1f seconds ago, lock can be broken.' % (
+                -remaining)
+    else:
+        print 'Holder: none'
+
+    waiters = []
+    orphans = []
+    for name in temp_files(lockfile):
+        if name == holder:
+            continue
+        state, gone = process_state(lockfile, name)
+        if gone:
+            orphans.append(name)
+        else:
+            waiters.append((name, state))
+    print 'Waiters: %d' % len(waiters)
+    for name, state in waiters:
+        print '  %s (%s)' % (name, state)
+    print 'Orphaned temporary files: %d' % len(orphans)
+    for name in orphans:
+        if options.clean:
+            try:
+                os.unlink(name)
+            except OSError, e:
+                print '  %s (not removed: %s)' % (name, e)
+            else:
+                print '  %s (removed)' % name
+        else:
+            print '  %s' % name
+
+    if not options.stats:
+        print 'No statistics, LOCKSTATS_LOCATION is not set.'
+        return
+    events = read_stats(options.stats)
+    acquired = events.get('acquire', [])
+    timeouts = events.get('timeout', [])
+    print 'Statistics from %s:' % options.stats
+    print '  Acquired: %d' % len(acquired)
+    print '  Timed out: %d' % len(timeouts)
+    print '  Stale locks broken: %d' % len(events.get('break', []))
+    for label, name in (('Wait', 'acquire'), ('Hold', 'hold')):
+        values = events.get(name)
+        if values:
+            print '  %s: %s' % (label, format_percentiles(values))
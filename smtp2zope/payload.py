@@ -0,0 +1,151 @@
+##
+# Structured payload for the email.
+#
+# Instead of only the raw email, the email is parsed here and posted as
+# multipart/form-data with these fields:
+#
+# Mail        = the raw email, unless STRUCTURED_RAW_MAIL is off
+# headers     = JSON object mapping header names to lists of decoded values
+# text        = the text/plain body, utf-8 encoded
+# html        = the text/html body, utf-8 encoded
+# attachments = JSON list with field, filename, content_type and size of
+#               every attachment
+# attachmentN = the decoded contents of the attachments
+#
+# This way the application server does not need to spend its threads on
+# parsing the email.
+
+import json
+import uuid
+from email.errors import HeaderParseError
+from email.header import decode_header
+from email.header import make_header
+
+from smtp2zope import config
+
+
+def decode_header_value(value):
+    """Return the header value as unicode."""
+    try:
+        return unicode(make_header(decode_header(value)))
+    except (HeaderParseError, LookupError, UnicodeError, ValueError):
+        # Unknown charset or broken encoded word.
+        return value.decode('utf-8', 'replace')
+
+
+def decode_text(part):
+    """Return the payload of a text part as unicode."""
+    payload = part.get_payload(decode=True) or ''
+    charset = part.get_content_charset() or 'us-ascii'
+    try:
+        return payload.decode(charset)
+    except (LookupError, UnicodeError):
+        return payload.decode('utf-8', 'replace')
+
+
+def is_attachment(part):
+    disposition = part.get('Content-Disposition', '')
+    if disposition.strip().lower().startswith('attachment'):
+        return True
+    return part.get_filename() is not None
+
+
+def parse_mail(message):
+    """Take the parsed email apart.
+
+    Returns a tuple of the headers, the text and html bodies (unicode or
+    None) and a list of attachment parts.
+    """
+    headers = {}
+    for name, value in message.items():
+        headers.setdefault(name, []).append(decode_header_value(value))
+
+    text = html = None
+    attachments = []
+    for part in message.walk():
+        if part.is_multipart():
+            continue
+        content_type = part.get_content_type()
+        if is_attachment(part):
+            attachments.append(part)
+        elif content_type == 'text/plain' and text is None:
+            text = decode_text(part)
+        elif content_type == 'text/html' and html is None:
+            html = decode_text(part)
+        else:
+            attachments.append(part)
+    return headers, text, html, attachments
+
+
+def safe_filename(filename):
+    """Return the filename without characters that could end it early.
+
+    Quotes and backslashes would end the quoted string, line breaks the
+    header.  The filename comes from the sender, so do not trust it.
+    """
+    for char in '"\\\r\n':
+        filename = filename.replace(char, '')
+    return filename
+
+
+def encode_multipart(fields, files):
+    """Encode fields and files as multipart/form-data.
+
+    fields is a list of (name, value) tuples, files a list of (name,
+    filename, content_type, value) tuples.  Returns the content type and
+    the body.
+    """
+    boundary = uuid.uuid4().hex
+    lines = []
+    for name, value in fields:
+        lines.append('--' + boundary)
+        lines.append('Content-Disposition: form-data; name="%s"' % name)
+        lines.append('')
+        lines.append(value)
+    for name, filename, content_type, value in files:
+        filename = safe_filename(filename)
+        lines.append('--' + boundary)
+        lines.append('Content-Disposition: form-data; name="%s"; '
+                     'filename="%s"' % (name, filename))
+        lines.append('Content-Type: %s' % content_type)
+        lines.append('')
+        lines.append(value)
+    lines.append('--' + boundary + '--')
+    lines.append('')
+    content_type = 'multipart/form-data; boundary=%s' % boundary
+    return content_type, '\r\n'.join(lines)
+
+
+def structured_payload(mailString, message):
+    """Return the content type and body of the structured payload.
+
+    message is the email parsed by an email.feedparser.FeedParser.
+    """
+    headers, text, html, parts = parse_mail(message)
+    fields = []
+    if config.STRUCTURED_RAW_MAIL:
+        fields.append((config.MAIL_PARAMETER_NAME, mailString))
+    fields.append(('headers', json.dumps(headers)))
+    if text is not None:
+        fields.append(('text', text.encode('utf-8')))
+    if html is not None:
+        fields.append(('html', html.encode('utf-8')))
+    manifest = []
+    files = []
+    for index, part in enumerate(parts):
+        name = 'attachment%d' % index
+        filename = part.get_filename() or name
+        if isinstance(filename, unicode):
+            filename = filename.encode('utf-8')
+        else:
+            filename = decode_header_value(filename).encode('utf-8')
+        filename = safe_filename(filename)
+        content_type = part.get_content_type()
+        value = part.get_payload(decode=True) or ''
+        manifest.append({'field': name,
+                         'filename': filename,
+                         'content_type': content_type,
+                         'size': len(value)})
+        files.append((name, filename, content_type, value))
+    fields.append(('attachments', json.dumps(manifest)))
+    return encode_multipart(fields, files)
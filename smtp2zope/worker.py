@@ -0,0 +1,69 @@
+##
+# Resident worker for the thin smtp2zope client.
+#
+# Usage: smtp2zope-worker [SOCKET]
+#
+# Listens on a Unix socket (config.WORKER_SOCKET by default) and forks a
+# child for every email a client hands over, so the delivery code only
+# needs to be loaded once.
+
+import os
+import SocketServer
+import sys
+
+from _multiprocessing import recvfd
+
+from smtp2zope import config
+from smtp2zope import script
+from smtp2zope.client import decode_args
+
+
+class WorkerHandler(SocketServer.StreamRequestHandler):
+
+    # Read the arguments unbuffered, so the byte carrying the file
+    # descriptor is left for recvfd.
+    rbufsize = 0
+
+    def handle(self):
+        args = decode_args(self.rfile.readline())
+        try:
+            mailfile = os.fdopen(recvfd(self.connection.fileno()), 'rb')
+            try:
+                status = script.process(args, mailfile)
+            finally:
+                mailfile.close()
+        except Exception, e:
+            script.log_error('A problem (%s) occurred in the worker.' % e)
+            status = script.EXIT_TEMPFAIL
+        self.wfile.write('%d\n' % status)
+
+
+class WorkerServer(SocketServer.ForkingMixIn, SocketServer.UnixStreamServer):
+    pass
+
+
+def main():
+    if len(sys.argv) > 2:
+        script.log_critical('Wrong number of parameters was given.')
+        sys.exit(script.EXIT_USAGE)
+    if len(sys.argv) == 2:
+        path = sys.argv[1]
+    else:
+        path = config.WORKER_SOCKET
+    if not path:
+        script.log_critical('No socket given and WORKER_SOCKET is not set.')
+        sys.exit(script.EXIT_USAGE)
+    # Remove a socket left behind by a previous worker.
+    if os.path.exists(path):
+        os.unlink(path)
+    # Make sure the MTA can connect when running in the same group.
+    oldmask = os.umask(002)
+    try:
+        server = WorkerServer(path, WorkerHandler)
+    finally:
+        os.umask(oldmask)
+    script.log_info('Worker listening on %s.' % path)
+    try:
+        server.serve_forever()
+    finally:
+        os.unlink(path)